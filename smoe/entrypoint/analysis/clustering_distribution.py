@@ -3,30 +3,39 @@ python -m smoe.entrypoint.analysis.clustering_distribution -d resources/clusteri
 """
 
 import argparse
+import json
+import warnings
+from collections import Counter
 from pathlib import Path
 
-from smoe.utils.io import load_jsonlines
 from smoe.utils.visualization.bar import barh
 
+SOURCES = (
+    "arxiv",
+    "books",
+    "c4",
+    "commoncrawl",
+    "github",
+    "stackexchange",
+    "wikipedia",
+)
+
 
 def main(args):
     data_dir = Path(args.data_dir)
 
     for file in data_dir.glob("*.jsonl"):
         cluster_idx = file.stem
-        source_to_num = {
-            "arxiv": 0,
-            "books": 0,
-            "c4": 0,
-            "commoncrawl": 0,
-            "github": 0,
-            "stackexchange": 0,
-            "wikipedia": 0,
-        }
-        data = load_jsonlines(file)
-        for ins in data:
-            source = ins["file"].split("-")[0]
-            source_to_num[source] += 1
+        with open(file, "r", encoding="utf8") as fin:
+            source_counter = Counter(
+                json.loads(line)["file"].partition("-")[0] for line in fin
+            )
+        source_to_num = {source: source_counter.pop(source, 0) for source in SOURCES}
+        if source_counter:
+            warnings.warn(
+                f"Unknown sources in {file}, counted as `other`: {dict(source_counter)}"
+            )
+            source_to_num["other"] = sum(source_counter.values())
         barh(
             source_to_num,
             title=f"Cluster {cluster_idx}",
@@ -106,7 +106,7 @@ def gate_recording_forward(self, x):
     top_k_scores = self.softmax(top_k_logits)
 
     """计算importance"""
-    zeros = torch.zeros_like(logits, requires_grad=True, device=logits.device)
+    zeros = torch.zeros_like(logits)
     scores_filtered = zeros.scatter(
         dim=1, index=top_k_indices, src=top_k_scores
     )  # shape(batch_size, num_experts)
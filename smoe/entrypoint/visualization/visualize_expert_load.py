@@ -2,6 +2,7 @@ import argparse
 import os
 import pickle
 
+import matplotlib.pyplot as plt
 import torch
 from torch.utils.data import DataLoader
 from tqdm import tqdm
@@ -10,12 +11,16 @@ from transformers import LlamaTokenizer
 from smoe.data.collate_fn import tensor_dict_cat_collator
 from smoe.data.datasets_moe import LineByLineJsonlTextDataset
 from smoe.models.llama_moe import LlamaMoEForCausalLM
+from smoe.utils.io import compress_png_image
 from smoe.utils.model_operation.modify_llama_moe_model import (
     llama_moe_with_hidden_states_recording,
 )
 from smoe.utils.operations.operation_string import str2bool
 from smoe.utils.seed import set_seed
-from smoe.utils.visualization.visualize import visualize_expert_load_heatmap
+from smoe.utils.visualization.visualize import (
+    find_factors_with_minimal_sum,
+    visualize_expert_load_heatmap,
+)
 
 # fmt: off
 if __name__ == "__main__":
@@ -51,7 +56,7 @@ if __name__ == "__main__":
     print(f"Dataset: {sum([torch.sum(dataset[i]['attention_mask']).item() for i in range(len(dataset))])} total tokens.")  # 统计非special token的数量
 
     """prepare dataloader"""
-    data_loader = DataLoader(dataset, batch_size=args.batch_size, collate_fn=tensor_dict_cat_collator, num_workers=8, pin_memory=True, persistent_workers=True)
+    data_loader = DataLoader(dataset, batch_size=args.batch_size, collate_fn=tensor_dict_cat_collator, num_workers=8, pin_memory=True, persistent_workers=True, prefetch_factor=4)
 
     """load model"""
     print("Loading llama model...")
@@ -70,19 +75,22 @@ if __name__ == "__main__":
     for step in tqdm(range(len(data_loader)), desc="forward step", position=0, leave=True):
         batch = next(iter_train)
         for key in batch.keys():
-            batch[key] = batch[key].to(device)
-        with torch.no_grad():
+            batch[key] = batch[key].to(device, non_blocking=True)
+        with torch.inference_mode():
             model(**batch)
 
     """visualization"""
     dataset_name = os.path.split(args.data_path)[1].split(".")[0] + args.save_name_prefix
-    for layer_idx, layer in enumerate(model.layers):
-        load_sum = layer.mlp.gate.load_sum.cpu().numpy()  # shape(num_experts)
+    load_sum_all = model.load_sum.cpu()  # 所有层的load一次性拷贝到cpu，shape(num_layers, num_experts)
+    img_grid = find_factors_with_minimal_sum(len(model.layers))
+    fig_heat, axes_heat = plt.subplots(*img_grid, figsize=[el * 5 for el in img_grid[::-1]], squeeze=False)  # 所有层复用同一个figure
+    for layer_idx in range(len(model.layers)):
+        load_sum = load_sum_all[layer_idx].numpy()  # shape(num_experts)
         visualize_expert_load_heatmap(
             load_sum,
             layer_idx,
             dataset_name,
-            save_dir=args.save_path + "-heat"
+            ax=axes_heat[layer_idx // img_grid[1], layer_idx % img_grid[1]]
         )
         # visualize_expert_load_barv(
         #     load_sum,
@@ -91,24 +99,24 @@ if __name__ == "__main__":
         #     save_dir=args.save_path + "-bar"
         # )
 
+    # 所有层的heatmap保存在同一张网格图"{save_path}-heat/{dataset_name}.png"中，不再按层保存为"{save_path}-heat/layer{i}/{dataset_name}_Layer{i}.png"
+    # 网格图尺寸为每层5英寸，因此使用较低的dpi (32层时4x8网格约为4000x2000像素)
+    if not os.path.exists(args.save_path + "-heat"):
+        os.makedirs(args.save_path + "-heat")
+    heat_path = os.path.join(args.save_path + "-heat", dataset_name + ".png")
+    fig_heat.tight_layout()
+    fig_heat.savefig(heat_path, dpi=100, bbox_inches="tight")
+    compress_png_image(heat_path, print_info=False)
+    plt.close(fig_heat)
+
     """save evaluation results as cache"""
     saved_dict = {
-        "samples_cnt": model.layers[0].mlp.gate.samples_cnt,
-        "importance_sum_list": [],
-        "importance_loss_sum_list": [],
-        "load_sum_list": [],
-        "load_loss_sum_list": [],
+        "samples_cnt": model.layers[0].mlp.gate.samples_cnt.item(),
+        "importance_sum": model.importance_sum.cpu(),  # 各层记录值保存为一个stacked tensor，shape(num_layers, num_experts)，可按层索引，替代旧版的"importance_sum_list"
+        "importance_loss_sum": model.importance_loss_sum.cpu(),  # shape(num_layers, 1)
+        "load_sum": load_sum_all,  # shape(num_layers, num_experts)
+        "load_loss_sum": model.load_loss_sum.cpu(),  # shape(num_layers, 1)
     }
-    importance_sum_list = []
-    importance_loss_sum_list = []
-    load_sum_list = []
-    load_loss_sum_list = []
-
-    for layer_idx, layer in enumerate(model.layers):  # locate block by the name template
-        saved_dict["importance_sum_list"].append(layer.mlp.gate.importance_sum.cpu())
-        saved_dict["importance_loss_sum_list"].append(layer.mlp.gate.importance_loss_sum.cpu())
-        saved_dict["load_sum_list"].append(layer.mlp.gate.load_sum.cpu())
-        saved_dict["load_loss_sum_list"].append(layer.mlp.gate.load_loss_sum.cpu())
 
     if not os.path.exists(args.save_path + "-results"):
         os.makedirs(args.save_path + "-results")
@@ -3,7 +3,6 @@ import warnings
 import torch
 from deepspeed.moe.sharded_moe import gumbel_rsample
 from torch import nn
-from torch.distributions.normal import Normal
 
 valid_gate_type = ("linear", "mlp")
 
@@ -252,9 +251,6 @@ class TopKBalancedNoisyGate(BaseGate):
                 device=self.weight_noise.weight.data.device,
                 dtype=self.weight_noise.weight.data.dtype,
             )
-            self.mean = 0.0
-            self.std = 1.0
-            self.normal = Normal(self.mean, self.std)
             self.softplus = nn.Softplus()
 
         self.reset_parameters()
@@ -292,42 +288,41 @@ class TopKBalancedNoisyGate(BaseGate):
             logits = logits_gate  # 最终权重，shape(batch_size, num_experts)
 
         """选出前k个权重，并计算各个专家的分数scores"""
-        top_logits, top_indices = logits.topk(min(self.num_selects + 1, self.num_experts), dim=1)  # 选择并排序前k+1个权重
-        top_k_logits = top_logits[:, :self.num_selects]
-        top_k_indices = top_indices[:, :self.num_selects]
-        top_k_scores = self.softmax(top_k_logits.to(torch.float32)) if self.use_softmax else top_k_logits
-        top_k_scores = top_k_scores.to(logits.dtype)
+        if self.training and self.add_noise and self.num_selects != self.num_experts:
+            top_logits, top_indices = logits.topk(self.num_selects + 1, dim=1)  # 选择并排序前k+1个权重，第k与k+1个权重用作计算load的阈值
+            top_k_logits = top_logits[:, :self.num_selects]
+            top_k_indices = top_indices[:, :self.num_selects]
+        else:
+            top_k_logits, top_k_indices = logits.topk(self.num_selects, dim=1, sorted=False)  # 不需要阈值时只选择前k个权重，softmax与顺序无关，无需排序
+        if self.use_softmax and self.num_selects == 1 and not torch.is_grad_enabled():
+            top_k_scores = torch.ones_like(top_k_logits)  # 只选择1个专家时，softmax的结果恒为1；需要梯度时仍计算softmax，使gate_network保留在计算图中
+        else:
+            top_k_scores = self.softmax(top_k_logits.to(torch.float32)) if self.use_softmax else top_k_logits
+            top_k_scores = top_k_scores.to(logits.dtype)
 
         """计算importance"""
-        zeros = torch.zeros_like(logits, requires_grad=True, device=logits.device)
-        scores_filtered = zeros.scatter(dim=1, index=top_k_indices, src=top_k_scores)  # shape(batch_size, num_experts)
-        importance = scores_filtered.sum(0)  # shape(num_experts)
+        importance = torch.zeros((self.num_experts,), device=x.device, dtype=torch.float32)  # 在fp32下累加，避免半精度atomic add的舍入误差
+        importance = importance.scatter_add_(0, top_k_indices.reshape(-1), top_k_scores.float().reshape(-1)).to(top_k_scores.dtype)  # shape(num_experts)
 
         """计算load"""
         # zhutong: 不要把`self.training`写在里面的if语句中，否则会导致eval模式下balance_loss输出值设备不匹配的错误
         if self.training:
             if self.add_noise and self.num_selects != self.num_experts:
-                batch_size = top_logits.size(0)
-                m = top_logits.size(1)
-                top_values_flat = top_logits.flatten()
-                threshold_positions_if_in = torch.arange(batch_size, device=x.device) * m + self.num_selects
-                threshold_if_in = torch.unsqueeze(torch.gather(top_values_flat, 0, threshold_positions_if_in), 1)
+                threshold_if_in = top_logits[:, self.num_selects:self.num_selects + 1]  # shape(batch_size, 1)
                 is_in = torch.gt(logits_noise, threshold_if_in)
-                threshold_positions_if_out = threshold_positions_if_in - 1
-                threshold_if_out = torch.unsqueeze(torch.gather(top_values_flat, 0, threshold_positions_if_out), 1)
+                threshold_if_out = top_logits[:, self.num_selects - 1:self.num_selects]  # shape(batch_size, 1)
                 # is each value currently in the top k.
-                prob_if_in = self.normal.cdf((logits_gate - threshold_if_in) / noise_control)
-                prob_if_out = self.normal.cdf((logits_gate - threshold_if_out) / noise_control)
+                prob_if_in, prob_if_out = torch.special.ndtr(torch.stack((logits_gate - threshold_if_in, logits_gate - threshold_if_out)) / noise_control)  # 标准正态分布的cdf，两组阈值合并为一次计算
                 prob = torch.where(is_in, prob_if_in, prob_if_out)
                 load = prob.sum(0)
             else:
-                load = (scores_filtered > 0).sum(0)
+                load = torch.zeros((self.num_experts,), device=x.device, dtype=torch.long).scatter_add_(0, top_k_indices.reshape(-1), (top_k_scores > 0).reshape(-1).long())
                 if not self.add_noise and not self.warned:
                     warnings.warn('Gradient-trackable implementation for load calculation is only available when "add_noise=True". '
                                   'Training without noise will block the gradient from "load" path and lead to inconsistency in optimization objectives.')
                     self.warned = True
         else:
-            load = (scores_filtered > 0).sum(0)
+            load = torch.zeros((self.num_experts,), device=x.device, dtype=torch.long).scatter_add_(0, top_k_indices.reshape(-1), (top_k_scores > 0).reshape(-1).long())
 
         """计算balance loss"""
         if self.use_balance:
@@ -365,41 +360,40 @@ class TopKBalancedNoisyGate(BaseGate):
         scores = self.softmax(logits) if self.use_softmax else logits
 
         """选出前k个权重，并计算各个专家的分数scores"""
-        top_logits, top_indices = logits.topk(min(self.num_selects + 1, self.num_experts), dim=1)  # 选择并排序前k+1个权重
-        top_k_logits = top_logits[:, :self.num_selects]
-        top_k_indices = top_indices[:, :self.num_selects]
-        top_k_scores = self.softmax(top_k_logits) if self.use_softmax else top_k_logits
+        if self.training and self.add_noise and self.num_selects != self.num_experts:
+            top_logits, top_indices = logits.topk(self.num_selects + 1, dim=1)  # 选择并排序前k+1个权重，第k与k+1个权重用作计算load的阈值
+            top_k_logits = top_logits[:, :self.num_selects]
+            top_k_indices = top_indices[:, :self.num_selects]
+        else:
+            top_k_logits, top_k_indices = logits.topk(self.num_selects, dim=1, sorted=False)  # 不需要阈值时只选择前k个权重，softmax与顺序无关，无需排序
+        if self.use_softmax and self.num_selects == 1 and not torch.is_grad_enabled():
+            top_k_scores = torch.ones_like(top_k_logits)  # 只选择1个专家时，softmax的结果恒为1；需要梯度时仍计算softmax，使gate_network保留在计算图中
+        else:
+            top_k_scores = self.softmax(top_k_logits) if self.use_softmax else top_k_logits
 
         """计算importance"""
-        zeros = torch.zeros_like(logits, requires_grad=True, device=logits.device)
-        scores_filtered = zeros.scatter(dim=1, index=top_k_indices, src=top_k_scores)  # shape(batch_size, num_experts)
-        importance = scores_filtered.sum(0)  # shape(num_experts)
+        importance = torch.zeros((self.num_experts,), device=x.device, dtype=torch.float32)  # 在fp32下累加，避免半精度atomic add的舍入误差
+        importance = importance.scatter_add_(0, top_k_indices.reshape(-1), top_k_scores.float().reshape(-1)).to(top_k_scores.dtype)  # shape(num_experts)
 
         """计算load"""
         # zhutong: 不要把`self.training`写在里面的if语句中，否则会导致eval模式下balance_loss输出值设备不匹配的错误
         if self.training:
             if self.add_noise and self.num_selects != self.num_experts:
-                batch_size = top_logits.size(0)
-                m = top_logits.size(1)
-                top_values_flat = top_logits.flatten()
-                threshold_positions_if_in = torch.arange(batch_size, device=x.device) * m + self.num_selects
-                threshold_if_in = torch.unsqueeze(torch.gather(top_values_flat, 0, threshold_positions_if_in), 1)
+                threshold_if_in = top_logits[:, self.num_selects:self.num_selects + 1]  # shape(batch_size, 1)
                 is_in = torch.gt(logits_noise, threshold_if_in)
-                threshold_positions_if_out = threshold_positions_if_in - 1
-                threshold_if_out = torch.unsqueeze(torch.gather(top_values_flat, 0, threshold_positions_if_out), 1)
+                threshold_if_out = top_logits[:, self.num_selects - 1:self.num_selects]  # shape(batch_size, 1)
                 # is each value currently in the top k.
-                prob_if_in = self.normal.cdf((logits_gate - threshold_if_in) / noise_control)
-                prob_if_out = self.normal.cdf((logits_gate - threshold_if_out) / noise_control)
+                prob_if_in, prob_if_out = torch.special.ndtr(torch.stack((logits_gate - threshold_if_in, logits_gate - threshold_if_out)) / noise_control)  # 标准正态分布的cdf，两组阈值合并为一次计算
                 prob = torch.where(is_in, prob_if_in, prob_if_out)
                 load = prob.sum(0)
             else:
-                load = (scores_filtered > 0).sum(0)
+                load = torch.zeros((self.num_experts,), device=x.device, dtype=torch.long).scatter_add_(0, top_k_indices.reshape(-1), (top_k_scores > 0).reshape(-1).long())
                 if not self.add_noise and not self.warned:
                     warnings.warn('Gradient-trackable implementation for load calculation is only available when "add_noise=True". '
                                   'Training without noise will block the gradient from "load" path and lead to inconsistency in optimization objectives.')
                     self.warned = True
         else:
-            load = (scores_filtered > 0).sum(0)
+            load = torch.zeros((self.num_experts,), device=x.device, dtype=torch.long).scatter_add_(0, top_k_indices.reshape(-1), (top_k_scores > 0).reshape(-1).long())
 
         """计算balance loss"""
         if self.use_balance:
@@ -100,7 +100,7 @@ def forward_topk_balanced_noisy_gate_with_hidden_states_recording(
     self, x, padding_mask, **kwargs
 ):
     # fmt: off
-    self.samples_cnt += torch.sum(padding_mask).item()  ####################################
+    self.samples_cnt += torch.sum(padding_mask)  ####################################
 
     """先计算所有专家的权重值"""
     logits = self.gate_network(x)  # gate计算出的权重
@@ -111,7 +111,7 @@ def forward_topk_balanced_noisy_gate_with_hidden_states_recording(
     top_k_indices = top_indices[:, :self.num_selects]
     top_k_scores = self.softmax(top_k_logits) if self.use_softmax else top_k_logits  # 对前k个计算softmax，得到对应的分数
 
-    zeros = torch.zeros_like(logits, requires_grad=True, device=logits.device)
+    zeros = torch.zeros_like(logits)
     scores_filtered = zeros.scatter(dim=1, index=top_k_indices, src=top_k_scores)  # shape(batch_size, num_experts)
     scores_filtered = scores_filtered[padding_mask]  ###############################################
 
@@ -639,7 +639,7 @@ def forward_topk_balanced_noisy_gate_with_selected_pair_recording(self, x):
     top_k_scores = self.softmax(top_k_logits) if self.use_softmax else top_k_logits
 
     """计算importance"""
-    zeros = torch.zeros_like(logits, requires_grad=True, device=logits.device)
+    zeros = torch.zeros_like(logits)
     scores_filtered = zeros.scatter(
         dim=1, index=top_k_indices, src=top_k_scores
     )  # shape(batch_size, num_experts)
@@ -664,11 +664,11 @@ def forward_topk_balanced_noisy_gate_with_selected_pair_recording(self, x):
                 torch.gather(top_values_flat, 0, threshold_positions_if_out), 1
             )
             # is each value currently in the top k.
-            prob_if_in = self.normal.cdf(
-                (logits_gate - threshold_if_in) / noise_control
-            )
-            prob_if_out = self.normal.cdf(
-                (logits_gate - threshold_if_out) / noise_control
+            prob_if_in, prob_if_out = torch.special.ndtr(
+                torch.stack(
+                    (logits_gate - threshold_if_in, logits_gate - threshold_if_out)
+                )
+                / noise_control
             )
             prob = torch.where(is_in, prob_if_in, prob_if_out)
             load = prob.sum(0)
@@ -109,6 +109,13 @@ def llama_moe_with_hidden_states_recording(model, device):
 
     model.forward = types.MethodType(forward_llama_moe_model_with_padding_mask, model)  # change forward function for LlamaMoEModel
 
+    # 所有层的记录值存放在同一个stacked tensor中，各层gate持有对应行的view，汇总时只需一次拷贝
+    num_layers = len(model.layers)
+    model.importance_sum = torch.zeros((num_layers, model.config.num_experts), device=device)
+    model.importance_loss_sum = torch.zeros((num_layers, 1), device=device)
+    model.load_sum = torch.zeros((num_layers, model.config.num_experts), device=device)
+    model.load_loss_sum = torch.zeros((num_layers, 1), device=device)
+
     for layer_idx, layer in enumerate(model.layers):  # locate block by the name template
         assert isinstance(layer.mlp.gate, TopKBalancedNoisyGate)
 
@@ -116,11 +123,11 @@ def llama_moe_with_hidden_states_recording(model, device):
         layer.mlp.forward = types.MethodType(forward_linear_glu_moe_layer_with_padding_mask, layer.mlp)  # change forward function for LinearGLUMoELayer
         layer.mlp.gate.forward = types.MethodType(forward_topk_balanced_noisy_gate_with_hidden_states_recording, layer.mlp.gate)  # change forward function TopKBalancedNoisyGate
 
-        layer.mlp.gate.samples_cnt = 0
-        layer.mlp.gate.importance_sum = torch.zeros((model.config.num_experts,), device=device)
-        layer.mlp.gate.importance_loss_sum = torch.zeros((1,), device=device)
-        layer.mlp.gate.load_sum = torch.zeros((model.config.num_experts,), device=device)
-        layer.mlp.gate.load_loss_sum = torch.zeros((1,), device=device)
+        layer.mlp.gate.samples_cnt = torch.zeros((), dtype=torch.long, device=device)
+        layer.mlp.gate.importance_sum = model.importance_sum[layer_idx]  # shape(num_experts)
+        layer.mlp.gate.importance_loss_sum = model.importance_loss_sum[layer_idx]  # shape(1)
+        layer.mlp.gate.load_sum = model.load_sum[layer_idx]  # shape(num_experts)
+        layer.mlp.gate.load_loss_sum = model.load_loss_sum[layer_idx]  # shape(1)
 
     return model
     # fmt: on
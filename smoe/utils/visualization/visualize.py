@@ -295,20 +295,29 @@ def visualize_expert_load_heatmap(
     shape: tuple = (4, 4),
     save_dir: str = "results/expert_load_vis",
     save_fig: bool = True,
+    ax: mpl.axes.Axes = None,
 ):
-    save_dir_path = Path(os.path.join(save_dir, f"layer{layer_idx}"))
-    if save_dir_path.is_file():
-        raise ValueError(f"{save_dir} is a file, not a directory")
-    save_dir_path.mkdir(exist_ok=True, parents=True)
-    # path = save_dir_path / Path(f"{dataset_name}_Layer{layer_idx}.pdf")
-    # print(layer_idx, path)
-    path = save_dir_path / Path(f"{dataset_name}_Layer{layer_idx}.png")
-
+    """
+    If `ax` is given, draw the heatmap into it and leave the layout & saving
+    of its figure to the caller, so one figure can be reused across layers.
+    """
     data = load_sum.reshape(*shape)
 
     cmap = mpl.colormaps["OrRd"]
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
+    if ax is None:
+        save_dir_path = Path(os.path.join(save_dir, f"layer{layer_idx}"))
+        if save_dir_path.is_file():
+            raise ValueError(f"{save_dir} is a file, not a directory")
+        save_dir_path.mkdir(exist_ok=True, parents=True)
+        # path = save_dir_path / Path(f"{dataset_name}_Layer{layer_idx}.pdf")
+        # print(layer_idx, path)
+        path = save_dir_path / Path(f"{dataset_name}_Layer{layer_idx}.png")
+
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+    else:
+        path = None
+        fig = ax.figure
     im = ax.imshow(data, cmap=cmap, interpolation="nearest")
     # im = ax.imshow(data, cmap=cmap, interpolation="nearest", vmin=3500, vmax=4500)
 
@@ -318,12 +327,13 @@ def visualize_expert_load_heatmap(
 
     ax.set_title(f"{dataset_name} - Layer {layer_idx}")
     ax.set_axis_off()
-    fig.colorbar(im)
-    fig.tight_layout()
-    if save_fig:
-        fig.savefig(str(path), dpi=320, bbox_inches="tight")
-        if path.suffix == ".png":
-            compress_png_image(str(path), print_info=False)
+    fig.colorbar(im, ax=ax)
+    if path is not None:
+        fig.tight_layout()
+        if save_fig:
+            fig.savefig(str(path), dpi=320, bbox_inches="tight")
+            if path.suffix == ".png":
+                compress_png_image(str(path), print_info=False)
     return fig
 
 
@@ -438,15 +448,20 @@ def visualize_expert_load_barv(
     y_max: float = None,
     x_label: str = None,
     save_dir: str = "results/expert_load_vis",
+    ax: mpl.axes.Axes = None,
 ):
-    save_dir_path = Path(os.path.join(save_dir, f"layer{layer_idx}"))
-    if save_dir_path.is_file():
-        raise ValueError(f"{save_dir} is a file, not a directory")
-    save_dir_path.mkdir(exist_ok=True, parents=True)
-    path = save_dir_path / Path(f"{dataset_name}_Layer{layer_idx}.png")
-
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
+    """With `ax` given, only the bars are drawn and nothing is saved or closed."""
+    if ax is None:
+        save_dir_path = Path(os.path.join(save_dir, f"layer{layer_idx}"))
+        if save_dir_path.is_file():
+            raise ValueError(f"{save_dir} is a file, not a directory")
+        save_dir_path.mkdir(exist_ok=True, parents=True)
+        path = save_dir_path / Path(f"{dataset_name}_Layer{layer_idx}.png")
+
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+    else:
+        path = None
     xs = range(load_sum.shape[0])
     ax.bar(xs, load_sum)
     ax.set_xticks(xs)
@@ -457,6 +472,8 @@ def visualize_expert_load_barv(
         ax.set_xlabel(x_label)
     ax.grid(True)
     ax.set_axisbelow(True)
-    fig.tight_layout()
-    fig.savefig(path, dpi=320, bbox_inches="tight")
-    compress_png_image(path, print_info=False)
+    if path is not None:
+        fig.tight_layout()
+        fig.savefig(path, dpi=320, bbox_inches="tight")
+        compress_png_image(path, print_info=False)
+        plt.close(fig)
@@ -0,0 +1,126 @@
+import pytest
+import torch
+from torch.distributions.normal import Normal
+
+from smoe.modules.moe.moe_gates import TopKBalancedNoisyGate
+from smoe.utils.seed import set_seed
+
+
+# fmt: off
+def reference_forward(gate, x, return_scores=False):
+    """Dense scatter-then-sum implementation of `TopKBalancedNoisyGate`, kept as the numerical reference."""
+    logits_gate = gate.gate_network(x)
+    if gate.training and gate.add_noise:
+        noise_control = gate.softplus(gate.weight_noise(x)) + gate.noise_epsilon
+        logits_noise = torch.randn_like(logits_gate) * noise_control
+        logits = logits_gate + logits_noise
+    else:
+        logits = logits_gate
+
+    top_logits, top_indices = logits.topk(min(gate.num_selects + 1, gate.num_experts), dim=1)
+    top_k_logits = top_logits[:, :gate.num_selects]
+    top_k_indices = top_indices[:, :gate.num_selects]
+    if return_scores:
+        top_k_scores = gate.softmax(top_k_logits) if gate.use_softmax else top_k_logits
+    else:
+        top_k_scores = gate.softmax(top_k_logits.to(torch.float32)) if gate.use_softmax else top_k_logits
+        top_k_scores = top_k_scores.to(logits.dtype)
+
+    zeros = torch.zeros_like(logits)
+    scores_filtered = zeros.scatter(dim=1, index=top_k_indices, src=top_k_scores)
+    importance = scores_filtered.sum(0)
+
+    if gate.training and gate.add_noise and gate.num_selects != gate.num_experts:
+        batch_size, m = top_logits.shape
+        top_values_flat = top_logits.flatten()
+        threshold_positions_if_in = torch.arange(batch_size) * m + gate.num_selects
+        threshold_if_in = torch.unsqueeze(torch.gather(top_values_flat, 0, threshold_positions_if_in), 1)
+        is_in = torch.gt(logits_noise, threshold_if_in)
+        threshold_if_out = torch.unsqueeze(torch.gather(top_values_flat, 0, threshold_positions_if_in - 1), 1)
+        normal = Normal(0.0, 1.0)
+        prob_if_in = normal.cdf((logits_gate - threshold_if_in) / noise_control)
+        prob_if_out = normal.cdf((logits_gate - threshold_if_out) / noise_control)
+        load = torch.where(is_in, prob_if_in, prob_if_out).sum(0)
+    else:
+        load = (scores_filtered > 0).sum(0)
+
+    balance_loss = (gate.cv_squared(importance) + gate.cv_squared(load)) * gate.balance_loss_weight
+    return {
+        "topK_indices": top_k_indices,
+        "topK_scores": top_k_scores,
+        "balance_loss": balance_loss,
+        "load": load,
+        "importance": importance,
+    }
+
+
+def sort_by_expert(indices, scores):
+    order = indices.argsort(dim=1)
+    return indices.gather(1, order), scores.gather(1, order)
+
+
+def grads(outputs, gate, x):
+    inputs = [x] + list(gate.parameters())
+    if not outputs["balance_loss"].requires_grad:
+        return [None] * len(inputs)
+    return torch.autograd.grad(outputs["balance_loss"], inputs, allow_unused=True)
+
+
+@pytest.mark.parametrize("num_selects", [1, 2, 16])
+@pytest.mark.parametrize("use_softmax", [True, False])
+@pytest.mark.parametrize("add_noise", [True, False])
+@pytest.mark.parametrize("training", [True, False])
+@pytest.mark.parametrize("return_scores", [True, False])
+def test_topk_balanced_noisy_gate_matches_reference(num_selects, use_softmax, add_noise, training, return_scores):
+    set_seed(0)
+    gate = TopKBalancedNoisyGate(32, 16, num_selects, use_softmax=use_softmax, add_noise=add_noise)
+    for param in gate.parameters():
+        torch.nn.init.normal_(param, std=0.3)
+    gate.train(training)
+    x = torch.randn(64, 32, requires_grad=True)
+
+    set_seed(1)
+    outputs = gate.forward_return_scores(x) if return_scores else gate(x)
+    set_seed(1)
+    expected = reference_forward(gate, x, return_scores=return_scores)
+
+    if not return_scores:
+        indices, scores = sort_by_expert(outputs["topK_indices"], outputs["topK_scores"])
+        expected_indices, expected_scores = sort_by_expert(expected["topK_indices"], expected["topK_scores"])
+        assert torch.equal(indices, expected_indices)
+        assert torch.allclose(scores, expected_scores, atol=1e-6)
+    for key in ("importance", "load", "balance_loss"):
+        assert outputs[key].dtype == expected[key].dtype
+        assert torch.allclose(outputs[key].double(), expected[key].double(), atol=1e-5, rtol=1e-4)
+
+    for grad, expected_grad in zip(grads(outputs, gate, x), grads(expected, gate, x)):
+        assert (grad is None) == (expected_grad is None)
+        if grad is not None:
+            assert torch.allclose(grad, expected_grad, atol=1e-6, rtol=1e-4)
+
+
+def test_topk_balanced_noisy_gate_importance_precision():
+    """`importance` is accumulated in fp32 even when the gate runs in half precision."""
+    set_seed(0)
+    gate = TopKBalancedNoisyGate(32, 16, 4, add_noise=False).to(torch.bfloat16)
+    x = torch.randn(8192, 32, dtype=torch.bfloat16)
+    outputs = gate(x)
+    expected = torch.zeros(16).scatter_add_(0, outputs["topK_indices"].reshape(-1), outputs["topK_scores"].float().reshape(-1))
+    assert outputs["importance"].dtype == torch.bfloat16
+    assert torch.allclose(outputs["importance"].float(), expected, rtol=1e-2)
+
+
+def test_topk_balanced_noisy_gate_top1_keeps_gate_network_in_graph():
+    set_seed(0)
+    gate = TopKBalancedNoisyGate(32, 16, 1, add_noise=False)
+    gate.train()
+    with pytest.warns(UserWarning):
+        outputs = gate(torch.randn(64, 32))
+    assert outputs["balance_loss"].requires_grad
+    outputs["balance_loss"].backward()
+    assert all(param.grad is not None for param in gate.gate_network.parameters())
+
+    with torch.no_grad():
+        outputs = gate(torch.randn(64, 32))
+    assert torch.equal(outputs["topK_scores"], torch.ones_like(outputs["topK_scores"]))
+# fmt: on
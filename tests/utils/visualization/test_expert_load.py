@@ -1,5 +1,6 @@
 import tempfile
 
+import matplotlib.pyplot as plt
 import numpy as np
 import pytest
 
@@ -55,3 +56,28 @@ def test_visualization_expert_load_barv():
             x_label="experts",
             save_dir=".gitignore",
         )
+
+
+def test_visualization_expert_load_with_shared_axes():
+    fig, axes = plt.subplots(2, 2)
+    for layer_idx, ax in enumerate(axes.flatten()):
+        load_sum = np.random.rand(16)
+        heat_fig = visualize_expert_load_heatmap(
+            load_sum,
+            layer_idx=layer_idx,
+            dataset_name="test",
+            shape=(4, 4),
+            save_dir=".gitignore",
+            ax=ax,
+        )
+        assert heat_fig is fig
+    _, axes = plt.subplots(1, 2)
+    for layer_idx, ax in enumerate(axes):
+        visualize_expert_load_barv(
+            np.random.rand(16),
+            layer_idx=layer_idx,
+            dataset_name="test",
+            save_dir=".gitignore",
+            ax=ax,
+        )
+    plt.close("all")